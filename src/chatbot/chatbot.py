@@ -2,19 +2,56 @@ from __future__ import annotations
 
 import json
 import logging
-import math
 import os
 import sqlite3
+from collections.abc import Iterable
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 import requests
 from dotenv import load_dotenv
-
-from path_config import get_error_log_file, get_ingest_db_path, get_log_dir
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from path_config import (
+    get_error_log_file,
+    get_ingest_db_path,
+    get_ingest_matrix_path,
+    get_ingest_meta_path,
+    get_log_dir,
+)
+
+try:
+    import simsimd
+except ImportError:
+    # Optional SIMD kernel; the NumPy matrix-vector product is the fallback.
+    simsimd = None
 
 LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
 
+CONNECT_TIMEOUT = 3
+EMBED_TIMEOUT = (CONNECT_TIMEOUT, 60)
+
+# Refused connections and gateway errors from a restarting Ollama are retried
+# with jittered backoff. Read timeouts are not: a slow model only gets more load.
+RETRIES = Retry(
+    total=3,
+    read=False,
+    backoff_factor=0.3,
+    backoff_jitter=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=("GET", "POST"),
+    raise_on_status=False,
+)
+
+# One pooled keep-alive session so repeated Ollama calls reuse TCP connections.
+SESSION = requests.Session()
+ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=RETRIES)
+SESSION.mount("http://", ADAPTER)
+SESSION.mount("https://", ADAPTER)
+
 
 def get_logger() -> logging.Logger:
     logger = logging.getLogger("chatbot")
@@ -41,7 +78,7 @@ def get_logger() -> logging.Logger:
     return logger
 
 
-def read_ingested_rows(db_path: Path) -> list[dict[str, Any]]:
+def read_ingested_rows(db_path: Path) -> tuple[np.ndarray, list[dict[str, Any]]]:
     if not db_path.exists():
         raise FileNotFoundError(f"Ingest DB not found: {db_path}")
 
@@ -49,9 +86,9 @@ def read_ingested_rows(db_path: Path) -> list[dict[str, Any]]:
     try:
         cursor = connection.execute(
             """
-            SELECT chunk_id, source_file, text, embedding_json, model
+            SELECT chunk_id, source_file, text, embedding, normalized, model
             FROM chunks
-            ORDER BY chunk_index ASC
+            ORDER BY source_file ASC, chunk_index ASC
             """
         )
         rows = cursor.fetchall()
@@ -61,56 +98,184 @@ def read_ingested_rows(db_path: Path) -> list[dict[str, Any]]:
     if not rows:
         raise ValueError(f"No records found in ingest DB: {db_path}")
 
-    parsed: list[dict[str, Any]] = []
-    for chunk_id, source_file, text, embedding_json, model in rows:
+    vectors: list[np.ndarray] = []
+    normalized_flags: list[bool] = []
+    records: list[dict[str, Any]] = []
+    for chunk_id, source_file, text, embedding, normalized, model in rows:
         try:
-            embedding = json.loads(embedding_json)
-        except json.JSONDecodeError as exc:
-            raise ValueError(f"Invalid embedding_json for chunk_id={chunk_id}") from exc
-
-        if not isinstance(embedding, list):
-            raise ValueError(f"Invalid embedding list for chunk_id={chunk_id}")
+            vectors.append(np.frombuffer(embedding, dtype=np.float32))
+        except (TypeError, ValueError) as exc:
+            raise ValueError(f"Invalid embedding blob for chunk_id={chunk_id}") from exc
+        normalized_flags.append(bool(normalized))
 
-        parsed.append(
+        records.append(
             {
                 "chunk_id": chunk_id,
                 "source_file": source_file,
                 "text": text,
-                "embedding": embedding,
                 "model": model,
             }
         )
 
-    return parsed
+    try:
+        embeddings = np.stack(vectors)
+    except ValueError as exc:
+        raise ValueError(
+            f"Inconsistent embedding dimensions in ingest DB: {db_path}"
+        ) from exc
+
+    # The pipeline stores unit-length vectors; only rows ingested without that
+    # guarantee are normalized here so scoring stays a single dot product.
+    pending = ~np.asarray(normalized_flags, dtype=bool)
+    if pending.any():
+        norms = np.linalg.norm(embeddings[pending], axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        embeddings[pending] /= norms
+    return np.ascontiguousarray(embeddings), records
+
+
+def read_matrix_sidecar(
+    db_path: Path,
+) -> tuple[np.ndarray, list[dict[str, Any]]] | None:
+    matrix_path = get_ingest_matrix_path()
+    meta_path = get_ingest_meta_path()
+    try:
+        db_mtime = db_path.stat().st_mtime
+        if min(matrix_path.stat().st_mtime, meta_path.stat().st_mtime) < db_mtime:
+            return None
+    except FileNotFoundError:
+        return None
+
+    # The matrix is memory-mapped: pages are read lazily and scoring needs no copy.
+    embeddings = np.load(matrix_path, mmap_mode="r")
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    records = [
+        {"chunk_id": chunk_id, "source_file": source_file, "text": text, "model": model}
+        for chunk_id, source_file, text, model in zip(
+            meta["chunk_id"],
+            meta["source_file"],
+            meta["text"],
+            meta["model"],
+            strict=True,
+        )
+    ]
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(records) or not records:
+        return None
+    return embeddings, records
+
+
+def index_sources(records: list[dict[str, Any]]) -> dict[str, slice]:
+    # Rows are ordered by source_file, so each source is one contiguous range and
+    # filtering by source scores a view of the matrix instead of a copy.
+    ranges: dict[str, slice] = {}
+    for idx, row in enumerate(records):
+        current = ranges.get(row["source_file"])
+        start = idx if current is None else current.start
+        ranges[row["source_file"]] = slice(start, idx + 1)
+    return ranges
+
+
+def resolve_source_filter(sources: Iterable[str], source_filter: str) -> str | None:
+    for source_file in sources:
+        path = Path(source_file)
+        if source_filter in {source_file, path.name, path.stem}:
+            return source_file
+    return None
+
+
+def load_sqlite_vec(connection: sqlite3.Connection) -> bool:
+    try:
+        import sqlite_vec
+
+        connection.enable_load_extension(True)
+        sqlite_vec.load(connection)
+        connection.enable_load_extension(False)
+    except (ImportError, AttributeError, sqlite3.OperationalError):
+        return False
+    return True
+
+
+def open_vector_index(db_path: Path) -> sqlite3.Connection | None:
+    if not db_path.exists():
+        raise FileNotFoundError(f"Ingest DB not found: {db_path}")
+
+    connection = sqlite3.connect(db_path)
+    if load_sqlite_vec(connection):
+        has_index = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'vec_chunks'"
+        ).fetchone()
+        if has_index:
+            return connection
+
+    # Fall back to in-memory scoring when sqlite-vec or its index is missing.
+    connection.close()
+    return None
+
+
+def read_index_sources(connection: sqlite3.Connection) -> list[str]:
+    rows = connection.execute("SELECT DISTINCT source_file FROM chunks").fetchall()
+    return [source_file for (source_file,) in rows]
+
 
+def read_index_summary(connection: sqlite3.Connection) -> tuple[int, str]:
+    total, model = connection.execute(
+        "SELECT COUNT(*), MAX(model) FROM chunks"
+    ).fetchone()
+    if not total:
+        raise ValueError("No records found in ingest DB.")
+    return int(total), str(model or "")
 
-def cosine_similarity(a: list[float], b: list[float]) -> float:
-    if len(a) != len(b):
-        return -1.0
-    dot = 0.0
-    norm_a = 0.0
-    norm_b = 0.0
-    for x, y in zip(a, b, strict=True):
-        dot += x * y
-        norm_a += x * x
-        norm_b += y * y
-    if norm_a == 0.0 or norm_b == 0.0:
-        return -1.0
-    return dot / (math.sqrt(norm_a) * math.sqrt(norm_b))
+
+def search_vector_index(
+    connection: sqlite3.Connection,
+    query_embedding: list[float],
+    top_k: int,
+    source_file: str | None = None,
+) -> list[dict[str, Any]]:
+    if top_k <= 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    # source_file is a vec0 metadata column, so the filter is applied inside the KNN.
+    source_clause = "AND source_file = ?" if source_file is not None else ""
+    params: tuple[Any, ...] = (query.tobytes(), top_k)
+    if source_file is not None:
+        params += (source_file,)
+    rows = connection.execute(
+        f"""
+        SELECT chunks.chunk_id, chunks.text, chunks.source_file, knn.distance
+        FROM (
+            SELECT rowid, distance
+            FROM vec_chunks
+            WHERE embedding MATCH ? AND k = ? {source_clause}
+        ) AS knn
+        JOIN chunks ON chunks.rowid = knn.rowid
+        ORDER BY knn.distance ASC
+        """,
+        params,
+    ).fetchall()
+    return [
+        {
+            "score": 1.0 - float(distance),
+            "chunk_id": chunk_id,
+            "text": text,
+            "source_file": source_file,
+        }
+        for chunk_id, text, source_file, distance in rows
+    ]
 
 
 def embed_text(base_url: str, model: str, text: str) -> list[float]:
-    response = requests.post(
+    response = SESSION.post(
         f"{base_url}/api/embed",
         json={"model": model, "input": text},
-        timeout=60,
+        timeout=EMBED_TIMEOUT,
     )
 
     if response.status_code == 404:
-        legacy = requests.post(
+        legacy = SESSION.post(
             f"{base_url}/api/embeddings",
             json={"model": model, "prompt": text},
-            timeout=60,
+            timeout=EMBED_TIMEOUT,
         )
         legacy.raise_for_status()
         payload = legacy.json()
@@ -133,7 +298,7 @@ def embed_text(base_url: str, model: str, text: str) -> list[float]:
 def ensure_ollama_available(base_url: str) -> None:
     tags_url = f"{base_url}/api/tags"
     try:
-        response = requests.get(tags_url, timeout=10)
+        response = SESSION.get(tags_url, timeout=(CONNECT_TIMEOUT, 10))
         response.raise_for_status()
     except requests.RequestException as exc:
         raise RuntimeError(
@@ -142,28 +307,57 @@ def ensure_ollama_available(base_url: str) -> None:
         ) from exc
 
 
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    # O(N) partition for the candidates, then O(k log k) to order just those.
+    # Selected rows with equal scores come back in row order.
+    k = min(top_k, scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    negated = -scores
+    if k < scores.size:
+        candidates = np.argpartition(negated, k - 1)[:k]
+        candidates.sort()
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(negated[candidates], kind="stable")]
+
+
 def retrieve_context(
     query_embedding: list[float],
+    embeddings: np.ndarray,
     records: list[dict[str, Any]],
     top_k: int,
+    source_rows: slice | None = None,
 ) -> list[dict[str, Any]]:
-    scored: list[dict[str, Any]] = []
-    for row in records:
-        embedding = row.get("embedding")
-        if not isinstance(embedding, list):
-            continue
-        score = cosine_similarity(query_embedding, embedding)
-        scored.append(
-            {
-                "score": score,
-                "chunk_id": row.get("chunk_id", ""),
-                "text": row.get("text", ""),
-                "source_file": row.get("source_file", ""),
-            }
-        )
-
-    scored.sort(key=lambda item: item["score"], reverse=True)
-    return scored[:top_k]
+    offset = 0
+    if source_rows is not None:
+        embeddings = embeddings[source_rows]
+        offset = source_rows.start
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    if top_k <= 0 or query.shape != (embeddings.shape[1],):
+        return []
+    query_norm = np.linalg.norm(query)
+    if query_norm == 0.0:
+        return []
+    query /= query_norm
+
+    if simsimd is not None:
+        distances = simsimd.cdist(query[None, :], embeddings, metric="cosine")
+        scores = 1.0 - np.asarray(distances, dtype=np.float32)[0]
+    else:
+        scores = embeddings @ query
+    top_idx = top_k_indices(scores, top_k)
+
+    return [
+        {
+            "score": float(scores[idx]),
+            "chunk_id": records[offset + idx]["chunk_id"],
+            "text": records[offset + idx]["text"],
+            "source_file": records[offset + idx]["source_file"],
+        }
+        for idx in top_idx
+    ]
 
 
 def generate_answer(
@@ -195,7 +389,7 @@ def generate_answer(
         "ANSWER (brief and accurate):"
     )
 
-    response = requests.post(
+    response = SESSION.post(
         f"{base_url}/api/generate",
         json={
             "model": model,
@@ -203,7 +397,7 @@ def generate_answer(
             "stream": False,
             "options": {"num_predict": 220},
         },
-        timeout=request_timeout,
+        timeout=(CONNECT_TIMEOUT, request_timeout),
     )
     response.raise_for_status()
     payload = response.json()
@@ -246,11 +440,32 @@ def main() -> None:
         request_timeout = parse_int_env("CHAT_REQUEST_TIMEOUT", 300)
         ensure_ollama_available(base_url)
 
-        records = read_ingested_rows(db_path)
+        vector_index = open_vector_index(db_path)
+        if vector_index is not None:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+            records: list[dict[str, Any]] = []
+            source_ranges: dict[str, slice] = {}
+            sources = read_index_sources(vector_index)
+            chunk_count, stored_model = read_index_summary(vector_index)
+        else:
+            loaded = read_matrix_sidecar(db_path)
+            if loaded is None:
+                loaded = read_ingested_rows(db_path)
+            embeddings, records = loaded
+            source_ranges = index_sources(records)
+            sources = list(source_ranges)
+            chunk_count, stored_model = len(records), str(records[0].get("model", ""))
+
+        source_filter = (os.getenv("CHAT_SOURCE_FILTER") or "").strip()
+        active_source = None
+        if source_filter:
+            active_source = resolve_source_filter(sources, source_filter)
+            if active_source is None:
+                raise RuntimeError(
+                    f"CHAT_SOURCE_FILTER matches no ingested source: {source_filter}"
+                )
 
-        embed_model = (os.getenv("OLLAMA_EMBED_MODEL") or "").strip() or str(
-            records[0].get("model", "")
-        )
+        embed_model = (os.getenv("OLLAMA_EMBED_MODEL") or "").strip() or stored_model
         if not embed_model:
             raise RuntimeError("Embedding model is missing. Set OLLAMA_EMBED_MODEL.")
 
@@ -258,12 +473,21 @@ def main() -> None:
         if not chat_model:
             raise RuntimeError("Missing OLLAMA_CHAT_MODEL in .env")
 
+        @lru_cache(maxsize=256)
+        def embed_question(question: str) -> tuple[float, ...]:
+            # Repeated questions in a session skip the embedding round-trip.
+            return tuple(embed_text(base_url, embed_model, question))
+
         logger.info("Chatbot started with chat model: %s", chat_model)
         logger.info("Using embedding model: %s", embed_model)
         logger.info(
-            "Loaded %d embedded chunks from ingest DB: %s", len(records), db_path
+            "Loaded %d embedded chunks from ingest DB: %s", chunk_count, db_path
         )
-        print("Type 'exit' to quit.")
+        if vector_index is not None:
+            logger.info("Using sqlite-vec index for retrieval.")
+        if active_source is not None:
+            logger.info("Restricting retrieval to source: %s", active_source)
+        print("Type 'exit' to quit. Use '/source NAME' to filter, '/source' to clear.")
 
         while True:
             try:
@@ -276,10 +500,41 @@ def main() -> None:
             if question.lower() in {"exit", "quit"}:
                 print("Bye.")
                 break
+            if question.split(maxsplit=1)[0] == "/source":
+                requested = question[len("/source") :].strip()
+                if not requested:
+                    active_source = None
+                    print("Source filter cleared.")
+                    continue
+                match = resolve_source_filter(sources, requested)
+                if match is None:
+                    print(f"No ingested source matches: {requested}")
+                else:
+                    active_source = match
+                    print(f"Source filter: {match}")
+                continue
 
             try:
-                query_embedding = embed_text(base_url, embed_model, question)
-                retrieved = retrieve_context(query_embedding, records, top_k=top_k)
+                query_embedding = list(embed_question(question))
+                if vector_index is not None:
+                    retrieved = search_vector_index(
+                        vector_index,
+                        query_embedding,
+                        top_k=top_k,
+                        source_file=active_source,
+                    )
+                else:
+                    retrieved = retrieve_context(
+                        query_embedding,
+                        embeddings,
+                        records,
+                        top_k=top_k,
+                        source_rows=(
+                            source_ranges[active_source]
+                            if active_source is not None
+                            else None
+                        ),
+                    )
 
                 if not retrieved:
                     print(
@@ -307,8 +562,8 @@ def main() -> None:
                 )
                 print(f"Assistant: {answer}")
 
-                sources = ", ".join(str(row["chunk_id"]) for row in retrieved)
-                print(f"Sources: {sources}")
+                cited = ", ".join(str(row["chunk_id"]) for row in retrieved)
+                print(f"Sources: {cited}")
                 print(f"Top similarity: {best_score:.4f}")
             except requests.Timeout:
                 logger.error("Chat request timed out.", exc_info=True)
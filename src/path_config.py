@@ -3,9 +3,13 @@ from __future__ import annotations
 from pathlib import Path
 
 DEFAULT_SCRAPED_OUTPUT_DIR = Path("scraped_pages")
+DEFAULT_WIKI_CACHE_DIR = Path("artifacts/cache/wiki")
 DEFAULT_CHUNK_OUTPUT_FILE = Path("artifacts/chunks/chunks.jsonl")
 DEFAULT_EMBEDDING_OUTPUT_FILE = Path("artifacts/embeddings/embeddings.jsonl")
+DEFAULT_EMBEDDING_CACHE_FILE = Path("artifacts/embeddings/embed_cache.sqlite3")
 DEFAULT_INGEST_DB_PATH = Path("artifacts/ingest/rag.sqlite3")
+DEFAULT_INGEST_MATRIX_FILE = Path("artifacts/ingest/embeddings.npy")
+DEFAULT_INGEST_META_FILE = Path("artifacts/ingest/meta.json")
 DEFAULT_LOG_DIR = Path("logs")
 DEFAULT_ERROR_LOG_FILE = DEFAULT_LOG_DIR / "errorlogs.txt"
 
@@ -14,6 +18,10 @@ def get_scraped_output_dir() -> Path:
     return DEFAULT_SCRAPED_OUTPUT_DIR
 
 
+def get_wiki_cache_dir() -> Path:
+    return DEFAULT_WIKI_CACHE_DIR
+
+
 def get_chunk_output_file() -> Path:
     return DEFAULT_CHUNK_OUTPUT_FILE
 
@@ -22,10 +30,22 @@ def get_embedding_output_file() -> Path:
     return DEFAULT_EMBEDDING_OUTPUT_FILE
 
 
+def get_embedding_cache_path() -> Path:
+    return DEFAULT_EMBEDDING_CACHE_FILE
+
+
 def get_ingest_db_path() -> Path:
     return DEFAULT_INGEST_DB_PATH
 
 
+def get_ingest_matrix_path() -> Path:
+    return DEFAULT_INGEST_MATRIX_FILE
+
+
+def get_ingest_meta_path() -> Path:
+    return DEFAULT_INGEST_META_FILE
+
+
 def get_log_dir() -> Path:
     return DEFAULT_LOG_DIR
 
@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import hashlib
-import json
+import logging
 import os
+import re
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
 
 from dotenv import load_dotenv
+from jsonl import dumps_line
 from logger import get_logger
 
 from path_config import get_chunk_output_file, get_scraped_output_dir
 
+# A blank line, optionally containing whitespace, separates paragraphs.
+PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
 
 def get_env_int(name: str, default: int) -> int:
     value = os.getenv(name)
@@ -32,8 +41,7 @@ def resolve_source_files() -> list[Path]:
 
 
 def split_paragraphs(text: str) -> list[str]:
-    parts = [p.strip() for p in text.split("\n\n")]
-    return [p for p in parts if p]
+    return [p for p in (part.strip() for part in PARAGRAPH_BREAK_RE.split(text)) if p]
 
 
 def make_chunks(text: str, chunk_size: int, overlap: int) -> list[str]:
@@ -44,52 +52,99 @@ def make_chunks(text: str, chunk_size: int, overlap: int) -> list[str]:
     if overlap >= chunk_size:
         raise ValueError("CHUNK_OVERLAP must be smaller than CHUNK_SIZE")
 
-    paragraphs = split_paragraphs(text)
+    # Work on offsets into one paragraph-joined buffer and slice each chunk once,
+    # instead of repeatedly copying the carried-over tail of the current chunk.
+    # The chunk being built is always buf[start:end].
+    buf = "\n\n".join(split_paragraphs(text))
     chunks: list[str] = []
-    current = ""
+    step = chunk_size - overlap
+    start = 0
+    end = 0
+
+    paragraph_start = 0
+    while paragraph_start < len(buf):
+        paragraph_end = buf.find("\n\n", paragraph_start)
+        if paragraph_end == -1:
+            paragraph_end = len(buf)
+
+        if end == start or paragraph_end - start > chunk_size:
+            if end > start:
+                chunks.append(buf[start:end])
+                start = max(start, end - overlap) if overlap > 0 else paragraph_start
+            else:
+                start = paragraph_start
 
-    for paragraph in paragraphs:
-        candidate = paragraph if not current else f"{current}\n\n{paragraph}"
-        if len(candidate) <= chunk_size:
-            current = candidate
-            continue
+            while paragraph_end - start > chunk_size:
+                chunks.append(buf[start : start + chunk_size])
+                start += step
 
-        if current:
-            chunks.append(current)
+        end = paragraph_end
+        paragraph_start = paragraph_end + 2
 
-            if overlap > 0:
-                carry = current[-overlap:]
-                current = f"{carry}\n\n{paragraph}"
-            else:
-                current = paragraph
-
-            while len(current) > chunk_size:
-                chunks.append(current[:chunk_size])
-                if overlap > 0:
-                    current = current[chunk_size - overlap :]
-                else:
-                    current = current[chunk_size:]
-        else:
-            tmp = paragraph
-            while len(tmp) > chunk_size:
-                chunks.append(tmp[:chunk_size])
-                if overlap > 0:
-                    tmp = tmp[chunk_size - overlap :]
-                else:
-                    tmp = tmp[chunk_size:]
-            current = tmp
-
-    if current.strip():
-        chunks.append(current)
+    if end > start:
+        chunks.append(buf[start:end])
 
     return [c.strip() for c in chunks if c.strip()]
 
 
-def write_jsonl(path: Path, records: list[dict]) -> None:
+def write_jsonl(path: Path, records: Iterable[dict]) -> int:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    # Stream into a temp file so a failed run never leaves a truncated artifact.
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    count = 0
+    with tmp_path.open("w", encoding="utf-8") as f:
         for row in records:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.write(dumps_line(row))
+            count += 1
+    tmp_path.replace(path)
+    return count
+
+
+def chunk_one(source_file: Path, chunk_size: int, overlap: int) -> list[dict]:
+    text = source_file.read_text(encoding="utf-8")
+    chunks = make_chunks(text, chunk_size=chunk_size, overlap=overlap)
+
+    # Non-cryptographic use: a short stable key per source path.
+    file_key = hashlib.blake2b(
+        str(source_file.resolve()).encode("utf-8"), digest_size=4
+    ).hexdigest()
+    return [
+        {
+            "chunk_id": f"{source_file.stem}-{file_key}-{idx:04d}",
+            "chunk_index": idx,
+            "source_file": str(source_file),
+            "text": chunk,
+        }
+        for idx, chunk in enumerate(chunks)
+    ]
+
+
+def iter_chunk_records(
+    source_files: list[Path],
+    chunk_size: int,
+    overlap: int,
+    max_workers: int,
+    logger: logging.Logger,
+) -> Iterator[dict]:
+    worker = partial(chunk_one, chunk_size=chunk_size, overlap=overlap)
+    logger.info("Chunking process is going on for %d source files.", len(source_files))
+
+    # Chunking is pure-Python CPU work, so files are spread across processes.
+    # A single worker stays in-process to skip the pool startup cost.
+    with ExitStack() as stack:
+        if max_workers > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=max_workers))
+            results = executor.map(worker, source_files)
+        else:
+            results = map(worker, source_files)
+
+        for source_file, file_records in zip(source_files, results, strict=True):
+            yield from file_records
+            logger.info(
+                "Chunking completed for file %s with %d chunks.",
+                source_file,
+                len(file_records),
+            )
 
 
 def run() -> Path:
@@ -102,36 +157,25 @@ def run() -> Path:
     output_file = get_chunk_output_file()
     chunk_size = get_env_int("CHUNK_SIZE", 1200)
     overlap = get_env_int("CHUNK_OVERLAP", 200)
-
-    records: list[dict] = []
-    for source_file in source_files:
-        logger.info("Chunking process is going on for source file: %s", source_file)
-        text = source_file.read_text(encoding="utf-8")
-        chunks = make_chunks(text, chunk_size=chunk_size, overlap=overlap)
-
-        file_key = hashlib.sha1(str(source_file.resolve()).encode("utf-8")).hexdigest()[
-            :8
-        ]
-        file_records = [
-            {
-                "chunk_id": f"{source_file.stem}-{file_key}-{idx:04d}",
-                "chunk_index": idx,
-                "source_file": str(source_file),
-                "text": chunk,
-            }
-            for idx, chunk in enumerate(chunks)
-        ]
-        records.extend(file_records)
-        logger.info(
-            "Chunking completed for file %s with %d chunks.",
-            source_file,
-            len(file_records),
-        )
-
-    write_jsonl(output_file, records)
+    max_workers = get_env_int(
+        "CHUNK_MAX_WORKERS", min(os.cpu_count() or 1, len(source_files))
+    )
+    if max_workers <= 0:
+        raise ValueError("CHUNK_MAX_WORKERS must be greater than 0")
+
+    total = write_jsonl(
+        output_file,
+        iter_chunk_records(
+            source_files,
+            chunk_size=chunk_size,
+            overlap=overlap,
+            max_workers=max_workers,
+            logger=logger,
+        ),
+    )
 
     logger.info("Total source files processed: %d", len(source_files))
-    logger.info("Chunking completed. Total chunks: %d", len(records))
+    logger.info("Chunking completed. Total chunks: %d", total)
     logger.info("Chunk file written at: %s", output_file)
     return output_file
 
@@ -1,14 +1,59 @@
 from __future__ import annotations
 
-import json
+import hashlib
+import logging
 import os
+import sqlite3
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 
+import numpy as np
 import requests
 from dotenv import load_dotenv
+from jsonl import dumps_line, loads_line
 from logger import get_logger
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
-from path_config import get_chunk_output_file, get_embedding_output_file
+from path_config import (
+    get_chunk_output_file,
+    get_embedding_cache_path,
+    get_embedding_output_file,
+)
+
+CONNECT_TIMEOUT = 3
+EMBED_TIMEOUT = (CONNECT_TIMEOUT, 60)
+
+# Refused connections and gateway errors from a restarting Ollama are retried
+# with jittered backoff. Read timeouts are not: a slow model only gets more load.
+RETRIES = Retry(
+    total=3,
+    read=False,
+    backoff_factor=0.3,
+    backoff_jitter=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=("GET", "POST"),
+    raise_on_status=False,
+)
+
+# One pooled keep-alive session so repeated Ollama calls reuse TCP connections.
+SESSION = requests.Session()
+ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=RETRIES)
+SESSION.mount("http://", ADAPTER)
+SESSION.mount("https://", ADAPTER)
+
+
+def get_env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError as exc:
+        raise ValueError(f"Invalid integer for {name}: {value}") from exc
 
 
 def read_jsonl(path: Path) -> list[dict]:
@@ -21,21 +66,27 @@ def read_jsonl(path: Path) -> list[dict]:
             line = line.strip()
             if not line:
                 continue
-            rows.append(json.loads(line))
+            rows.append(loads_line(line))
     return rows
 
 
-def write_jsonl(path: Path, records: list[dict]) -> None:
+def write_jsonl(path: Path, records: Iterable[dict]) -> int:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    # Stream into a temp file so a failed run never leaves a truncated artifact.
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    count = 0
+    with tmp_path.open("w", encoding="utf-8") as f:
         for row in records:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.write(dumps_line(row))
+            count += 1
+    tmp_path.replace(path)
+    return count
 
 
 def ensure_ollama_available(base_url: str) -> None:
     tags_url = f"{base_url}/api/tags"
     try:
-        response = requests.get(tags_url, timeout=10)
+        response = SESSION.get(tags_url, timeout=(CONNECT_TIMEOUT, 10))
         response.raise_for_status()
     except requests.RequestException as exc:
         raise RuntimeError(
@@ -44,37 +95,190 @@ def ensure_ollama_available(base_url: str) -> None:
         ) from exc
 
 
-def embed_text(base_url: str, model: str, text: str) -> list[float]:
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def open_embedding_cache(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cache (
+            model TEXT NOT NULL,
+            sha256 BLOB NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (model, sha256)
+        )
+        """
+    )
+    return connection
+
+
+def read_cached_embeddings(
+    connection: sqlite3.Connection, model: str, digests: list[bytes]
+) -> dict[bytes, list[float]]:
+    cached: dict[bytes, list[float]] = {}
+    for digest in set(digests):
+        row = connection.execute(
+            "SELECT vector FROM cache WHERE model = ? AND sha256 = ?",
+            (model, digest),
+        ).fetchone()
+        if row is not None:
+            cached[digest] = np.frombuffer(row[0], dtype=np.float32).tolist()
+    return cached
+
+
+def write_cached_embeddings(
+    connection: sqlite3.Connection,
+    model: str,
+    items: list[tuple[bytes, list[float]]],
+) -> None:
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO cache (model, sha256, vector) VALUES (?, ?, ?)",
+            [
+                (model, digest, np.asarray(vector, dtype=np.float32).tobytes())
+                for digest, vector in items
+            ],
+        )
+
+
+def l2_normalize(vector: list[float]) -> list[float]:
+    normalized = np.asarray(vector, dtype=np.float32)
+    normalized /= np.linalg.norm(normalized) + 1e-12
+    return normalized.tolist()
+
+
+def embed_text_legacy(base_url: str, model: str, text: str) -> list[float]:
+    legacy_url = f"{base_url}/api/embeddings"
+    legacy_response = SESSION.post(
+        legacy_url,
+        json={"model": model, "prompt": text},
+        timeout=EMBED_TIMEOUT,
+    )
+    legacy_response.raise_for_status()
+    legacy_payload = legacy_response.json()
+    vector = legacy_payload.get("embedding")
+    if not isinstance(vector, list):
+        raise RuntimeError("Unexpected embedding response from /api/embeddings")
+    return vector
+
+
+def embed_texts(base_url: str, model: str, texts: list[str]) -> list[list[float]]:
     embed_url = f"{base_url}/api/embed"
-    response = requests.post(
-        embed_url, json={"model": model, "input": text}, timeout=60
+    response = SESSION.post(
+        embed_url, json={"model": model, "input": texts}, timeout=EMBED_TIMEOUT
     )
 
     if response.status_code == 404:
-        legacy_url = f"{base_url}/api/embeddings"
-        legacy_response = requests.post(
-            legacy_url,
-            json={"model": model, "prompt": text},
-            timeout=60,
-        )
-        legacy_response.raise_for_status()
-        legacy_payload = legacy_response.json()
-        vector = legacy_payload.get("embedding")
-        if not isinstance(vector, list):
-            raise RuntimeError("Unexpected embedding response from /api/embeddings")
-        return vector
+        # Legacy endpoint only accepts a single prompt per request.
+        return [embed_text_legacy(base_url, model, text) for text in texts]
+
+    if response.status_code == 400 and len(texts) > 1:
+        # Fall back to one text per request if the server rejects list input.
+        return [embed_texts(base_url, model, [text])[0] for text in texts]
 
     response.raise_for_status()
     payload = response.json()
     embeddings = payload.get("embeddings")
-    if not isinstance(embeddings, list) or not embeddings:
+    if not isinstance(embeddings, list) or len(embeddings) != len(texts):
         raise RuntimeError("Unexpected embedding response from /api/embed")
 
-    vector = embeddings[0]
-    if not isinstance(vector, list):
-        raise RuntimeError("Unexpected embedding vector shape from /api/embed")
+    for vector in embeddings:
+        if not isinstance(vector, list):
+            raise RuntimeError("Unexpected embedding vector shape from /api/embed")
+
+    return embeddings
+
+
+def to_embedding_record(row: dict, vector: list[float], model: str) -> dict:
+    # Store unit-length vectors so retrieval can score with a plain dot product.
+    return {
+        "chunk_id": row["chunk_id"],
+        "chunk_index": row["chunk_index"],
+        "source_file": row["source_file"],
+        "text": row["text"],
+        "embedding": l2_normalize(vector),
+        "embedding_dim": len(vector),
+        "normalized": True,
+        "model": model,
+    }
 
-    return vector
+
+class PendingBatch(NamedTuple):
+    rows: list[dict]
+    digests: list[bytes]
+    cached: dict[bytes, list[float]]
+    misses: list[int]
+    future: Future[list[list[float]]] | None
+    rows_done: int
+
+
+def collect_batch(
+    pending: PendingBatch, cache: sqlite3.Connection, model: str
+) -> list[dict]:
+    if pending.future is not None:
+        fetched = [
+            (pending.digests[idx], vector)
+            for idx, vector in zip(pending.misses, pending.future.result(), strict=True)
+        ]
+        write_cached_embeddings(cache, model, fetched)
+        pending.cached.update(fetched)
+    return [
+        to_embedding_record(row, pending.cached[digest], model)
+        for row, digest in zip(pending.rows, pending.digests, strict=True)
+    ]
+
+
+def iter_embedding_records(
+    rows: list[dict],
+    *,
+    base_url: str,
+    model: str,
+    batch_size: int,
+    concurrency: int,
+    cache: sqlite3.Connection,
+    logger: logging.Logger,
+) -> Iterator[dict]:
+    # Keep a bounded window of batches in flight and yield them in input order,
+    # so records stream to disk instead of accumulating in memory.
+    in_flight: deque[PendingBatch] = deque()
+    cache_hits = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            digests = [text_digest(row["text"]) for row in batch]
+            cached = read_cached_embeddings(cache, model, digests)
+            misses = [idx for idx, digest in enumerate(digests) if digest not in cached]
+            cache_hits += len(batch) - len(misses)
+            future = None
+            if misses:
+                future = executor.submit(
+                    embed_texts, base_url, model, [batch[idx]["text"] for idx in misses]
+                )
+            in_flight.append(
+                PendingBatch(
+                    rows=batch,
+                    digests=digests,
+                    cached=cached,
+                    misses=misses,
+                    future=future,
+                    rows_done=start + len(batch),
+                )
+            )
+
+            while len(in_flight) > concurrency:
+                pending = in_flight.popleft()
+                yield from collect_batch(pending, cache, model)
+                logger.info("Embedding progress: %d/%d", pending.rows_done, len(rows))
+
+        while in_flight:
+            pending = in_flight.popleft()
+            yield from collect_batch(pending, cache, model)
+            logger.info("Embedding progress: %d/%d", pending.rows_done, len(rows))
+
+    logger.info("Embedding cache hits: %d/%d", cache_hits, len(rows))
 
 
 def run() -> Path:
@@ -89,38 +293,38 @@ def run() -> Path:
     selected_model = (os.getenv("OLLAMA_EMBED_MODEL") or "").strip()
     if not selected_model:
         raise RuntimeError("Missing OLLAMA_EMBED_MODEL in .env")
+    batch_size = get_env_int("EMBED_BATCH", 32)
+    if batch_size <= 0:
+        raise ValueError("EMBED_BATCH must be greater than 0")
+    concurrency = get_env_int("EMBED_CONCURRENCY", 4)
+    if concurrency <= 0:
+        raise ValueError("EMBED_CONCURRENCY must be greater than 0")
     ensure_ollama_available(base_url)
 
     chunks = read_jsonl(chunk_file)
     logger.info("Embedding process is going on for %d chunks.", len(chunks))
     logger.info("Using configured embedding model: %s", selected_model)
+    logger.info("Embedding batch size: %d (concurrency=%d)", batch_size, concurrency)
 
-    records: list[dict] = []
-    for idx, row in enumerate(chunks, start=1):
-        text = row.get("text", "")
-        if not text:
-            continue
-
-        vector = embed_text(base_url, selected_model, text)
-
-        records.append(
-            {
-                "chunk_id": row["chunk_id"],
-                "chunk_index": row["chunk_index"],
-                "source_file": row["source_file"],
-                "text": text,
-                "embedding": vector,
-                "embedding_dim": len(vector),
-                "model": selected_model,
-            }
+    rows = [row for row in chunks if row.get("text", "")]
+    cache = open_embedding_cache(get_embedding_cache_path())
+    try:
+        total = write_jsonl(
+            output_file,
+            iter_embedding_records(
+                rows,
+                base_url=base_url,
+                model=selected_model,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                cache=cache,
+                logger=logger,
+            ),
         )
+    finally:
+        cache.close()
 
-        if idx % 10 == 0 or idx == len(chunks):
-            logger.info("Embedding progress: %d/%d", idx, len(chunks))
-
-    write_jsonl(output_file, records)
-
-    logger.info("Embedding completed. Total embedding records: %d", len(records))
+    logger.info("Embedding completed. Total embedding records: %d", total)
     logger.info("Embedding file written at: %s", output_file)
     return output_file
 
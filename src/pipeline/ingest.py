@@ -4,10 +4,17 @@ import json
 import sqlite3
 from pathlib import Path
 
+import numpy as np
 from dotenv import load_dotenv
+from jsonl import loads_line
 from logger import get_logger
 
-from path_config import get_embedding_output_file, get_ingest_db_path
+from path_config import (
+    get_embedding_output_file,
+    get_ingest_db_path,
+    get_ingest_matrix_path,
+    get_ingest_meta_path,
+)
 
 
 def read_jsonl(path: Path) -> list[dict]:
@@ -22,10 +29,84 @@ def read_jsonl(path: Path) -> list[dict]:
             line = line.strip()
             if not line:
                 continue
-            rows.append(json.loads(line))
+            rows.append(loads_line(line))
     return rows
 
 
+def to_float32_blob(embedding: list[float]) -> bytes:
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def load_sqlite_vec(connection: sqlite3.Connection) -> bool:
+    try:
+        import sqlite_vec
+
+        connection.enable_load_extension(True)
+        sqlite_vec.load(connection)
+        connection.enable_load_extension(False)
+    except (ImportError, AttributeError, sqlite3.OperationalError):
+        # sqlite-vec is optional; the chatbot falls back to in-memory scoring.
+        return False
+    return True
+
+
+def build_vector_index(connection: sqlite3.Connection, rows: list[dict]) -> None:
+    latest_rows = {row["chunk_id"]: row for row in rows}
+    rowids = dict(connection.execute("SELECT chunk_id, rowid FROM chunks"))
+    dim = int(rows[0]["embedding_dim"])
+
+    connection.execute(
+        f"""
+        CREATE VIRTUAL TABLE vec_chunks USING vec0(
+            embedding float[{dim}] distance_metric=cosine,
+            source_file text
+        )
+        """
+    )
+    connection.executemany(
+        "INSERT INTO vec_chunks(rowid, embedding, source_file) VALUES (?, ?, ?)",
+        (
+            (
+                rowids[chunk_id],
+                to_float32_blob(row["embedding"]),
+                row["source_file"],
+            )
+            for chunk_id, row in latest_rows.items()
+        ),
+    )
+
+
+def write_matrix_sidecar(rows: list[dict], matrix_path: Path, meta_path: Path) -> None:
+    # Same rows and order the chatbot reads from the DB, so it can mmap the
+    # matrix at startup instead of decoding every blob out of SQLite.
+    latest_rows = {row["chunk_id"]: row for row in rows}
+    ordered = sorted(
+        latest_rows.values(),
+        key=lambda row: (row["source_file"], int(row["chunk_index"])),
+    )
+    matrix = np.asarray([row["embedding"] for row in ordered], dtype=np.float32)
+    pending = ~np.asarray([bool(row.get("normalized")) for row in ordered])
+    if pending.any():
+        norms = np.linalg.norm(matrix[pending], axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        matrix[pending] /= norms
+
+    meta = {
+        "chunk_id": [row["chunk_id"] for row in ordered],
+        "source_file": [row["source_file"] for row in ordered],
+        "text": [row["text"] for row in ordered],
+        "model": [row["model"] for row in ordered],
+    }
+
+    matrix_tmp = matrix_path.with_name(f"{matrix_path.name}.tmp")
+    with matrix_tmp.open("wb") as f:
+        np.save(f, matrix)
+    meta_tmp = meta_path.with_name(f"{meta_path.name}.tmp")
+    meta_tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    matrix_tmp.replace(matrix_path)
+    meta_tmp.replace(meta_path)
+
+
 def run() -> Path:
     logger = get_logger("pipeline.ingest")
     logger.info("Ingest process is starting.")
@@ -34,67 +115,107 @@ def run() -> Path:
 
     embedding_file = get_embedding_output_file()
     db_path = get_ingest_db_path()
+    matrix_path = get_ingest_matrix_path()
+    meta_path = get_ingest_meta_path()
 
     rows = read_jsonl(embedding_file)
     logger.info("Ingest process is going on for %d records.", len(rows))
 
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    connection = sqlite3.connect(db_path)
+    # Rebuild from scratch into a sibling file so the DB (and its optional
+    # vector index) always matches the latest embedding file, and a failed
+    # rebuild leaves the previous DB untouched.
+    tmp_db_path = db_path.with_name(f"{db_path.name}.tmp")
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{tmp_db_path}{suffix}").unlink(missing_ok=True)
+    connection = sqlite3.connect(tmp_db_path)
+    vector_index = False
 
     try:
-        connection.execute(
-            """
-            CREATE TABLE IF NOT EXISTS chunks (
-                chunk_id TEXT PRIMARY KEY,
-                chunk_index INTEGER NOT NULL,
-                source_file TEXT NOT NULL,
-                text TEXT NOT NULL,
-                embedding_json TEXT NOT NULL,
-                embedding_dim INTEGER NOT NULL,
-                model TEXT NOT NULL,
-                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute("PRAGMA cache_size=-65536")
+
+        # Load everything in one transaction so SQLite commits (and syncs) once.
+        # BEGIN is explicit: the sqlite3 module would otherwise autocommit the
+        # CREATE TABLE and only open a transaction at the first INSERT.
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    chunk_index INTEGER NOT NULL,
+                    source_file TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    embedding_dim INTEGER NOT NULL,
+                    normalized INTEGER NOT NULL DEFAULT 1,
+                    model TEXT NOT NULL,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+                """
             )
-            """
-        )
 
-        # Keep DB in sync with the latest embedding file instead of accumulating stale rows.
-        connection.execute("DELETE FROM chunks")
-
-        connection.executemany(
-            """
-            INSERT OR REPLACE INTO chunks (
-                chunk_id,
-                chunk_index,
-                source_file,
-                text,
-                embedding_json,
-                embedding_dim,
-                model
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            [
+            connection.executemany(
+                """
+                INSERT OR REPLACE INTO chunks (
+                    chunk_id,
+                    chunk_index,
+                    source_file,
+                    text,
+                    embedding,
+                    embedding_dim,
+                    normalized,
+                    model
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
                 (
-                    row["chunk_id"],
-                    int(row["chunk_index"]),
-                    row["source_file"],
-                    row["text"],
-                    json.dumps(row["embedding"]),
-                    int(row["embedding_dim"]),
-                    row["model"],
-                )
-                for row in rows
-            ],
-        )
+                    (
+                        row["chunk_id"],
+                        int(row["chunk_index"]),
+                        row["source_file"],
+                        row["text"],
+                        to_float32_blob(row["embedding"]),
+                        int(row["embedding_dim"]),
+                        int(bool(row.get("normalized", False))),
+                        row["model"],
+                    )
+                    for row in rows
+                ),
+            )
 
-        connection.commit()
+            if rows and load_sqlite_vec(connection):
+                build_vector_index(connection, rows)
+                vector_index = True
 
         total = connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
     finally:
         connection.close()
 
+    # Drop the old DB's WAL files first so they are never replayed onto the new one.
+    for suffix in ("-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+    tmp_db_path.replace(db_path)
+
+    # The sidecar is only touched once the new DB is in place; its own .tmp
+    # swap keeps it whole if writing it fails.
+    if rows:
+        write_matrix_sidecar(rows, matrix_path, meta_path)
+    else:
+        matrix_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+
     logger.info("Ingest completed. Ingested records this run: %d", len(rows))
     logger.info("Total rows currently in DB: %d", total)
+    if vector_index:
+        logger.info("sqlite-vec index built in table: vec_chunks")
+    else:
+        logger.info("sqlite-vec unavailable; skipped vector index.")
     logger.info("SQLite DB location: %s", db_path)
+    if rows:
+        logger.info("Embedding matrix sidecar: %s", matrix_path)
     return db_path
 
 
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; the stdlib json module is the fallback.
+    orjson = None
+
+
+def loads_line(line: str) -> dict:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def dumps_line(row: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(row).decode("utf-8") + "\n"
+    return json.dumps(row, ensure_ascii=False) + "\n"
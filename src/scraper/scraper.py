@@ -1,21 +1,61 @@
 from __future__ import annotations
 
+import hashlib
+import io
+import json
 import os
-import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import ssl
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Any
 from urllib.parse import quote
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
-from path_config import get_scraped_output_dir
+from path_config import get_scraped_output_dir, get_wiki_cache_dir
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; requests' stdlib json decoding is the fallback.
+    orjson = None
 
 WIKIPEDIA_API = "https://en.wikipedia.org/w/api.php"
 REQUEST_HEADERS = {
     "User-Agent": "agentic-rag/0.1 (local-dev-script)",
 }
 
+# Query strings with the fixed parameters pre-encoded; only the subject or
+# title is quoted into the trailing placeholder per request.
+OPENSEARCH_URL = (
+    f"{WIKIPEDIA_API}?action=opensearch&limit=1&namespace=0&format=json&search={{}}"
+)
+SEARCH_EXTRACT_URL = (
+    f"{WIKIPEDIA_API}?action=query&generator=search&gsrlimit=1"
+    "&prop=extracts%7Cinfo&explaintext=1&redirects=1&format=json&formatversion=2"
+    "&gsrsearch={}"
+)
+EXTRACT_URL = (
+    f"{WIKIPEDIA_API}?action=query&prop=extracts%7Cinfo&explaintext=1&redirects=1"
+    "&format=json&formatversion=2&titles={}"
+)
+REVISION_URL = (
+    f"{WIKIPEDIA_API}?action=query&prop=info&redirects=1"
+    "&format=json&formatversion=2&titles={}"
+)
+
+UNSAFE_FILENAME_CHARS = str.maketrans(dict.fromkeys('\\/:*?"<>|', "_"))
+
+# Shared keep-alive session: worker threads reuse pooled connections to the
+# API instead of paying a TCP + TLS handshake per request.
+SESSION = requests.Session()
+SESSION.headers.update(REQUEST_HEADERS)
+
 
 def env_flag(name: str, default: bool = False) -> bool:
     value = os.getenv(name)
@@ -24,33 +64,32 @@ def env_flag(name: str, default: bool = False) -> bool:
     return value.strip().lower() in {"1", "true", "yes", "on"}
 
 
-def configure_tls_from_system_store() -> None:
+def read_json(response: requests.Response) -> Any:
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def configure_tls_from_system_store() -> bool:
     try:
         import truststore
 
         truststore.inject_into_ssl()
     except Exception:
         # Keep running with certifi defaults if truststore is unavailable.
-        pass
+        return False
+    return True
 
 
+@lru_cache(maxsize=256)
 def search_wikipedia_title(subject: str, *, allow_insecure: bool) -> str:
-    params = {
-        "action": "opensearch",
-        "search": subject,
-        "limit": 1,
-        "namespace": 0,
-        "format": "json",
-    }
-    response = requests.get(
-        WIKIPEDIA_API,
-        params=params,
-        headers=REQUEST_HEADERS,
+    response = SESSION.get(
+        OPENSEARCH_URL.format(quote(subject, safe="")),
         timeout=20,
         verify=not allow_insecure,
     )
     response.raise_for_status()
-    payload = response.json()
+    payload = read_json(response)
 
     titles = payload[1] if len(payload) > 1 else []
     if not titles:
@@ -59,31 +98,45 @@ def search_wikipedia_title(subject: str, *, allow_insecure: bool) -> str:
     return titles[0]
 
 
-def fetch_page_extract(title: str, *, allow_insecure: bool) -> tuple[str, str]:
-    params = {
-        "action": "query",
-        "prop": "extracts",
-        "explaintext": 1,
-        "redirects": 1,
-        "titles": title,
-        "format": "json",
-        "formatversion": 2,
-    }
-    response = requests.get(
-        WIKIPEDIA_API,
-        params=params,
-        headers=REQUEST_HEADERS,
+def fetch_page_extract(title: str, *, allow_insecure: bool) -> tuple[str, str, int]:
+    response = SESSION.get(
+        EXTRACT_URL.format(quote(title, safe="")),
         timeout=20,
         verify=not allow_insecure,
     )
     response.raise_for_status()
-    payload = response.json()
+    payload = read_json(response)
 
     pages = payload.get("query", {}).get("pages", [])
     if not pages:
         raise ValueError(f"No page content returned for title: {title}")
 
-    page = pages[0]
+    return read_page_extract(pages[0], title)
+
+
+def fetch_title_and_extract(
+    subject: str, *, allow_insecure: bool
+) -> tuple[str, str, int]:
+    # One round-trip: the search generator feeds its top hit straight into
+    # prop=extracts instead of resolving the title with a separate opensearch.
+    # Subjects are not batched with titles=A|B: TextExtracts returns only one
+    # full (non-intro) extract per request, so extra titles just need continues.
+    response = SESSION.get(
+        SEARCH_EXTRACT_URL.format(quote(subject, safe="")),
+        timeout=20,
+        verify=not allow_insecure,
+    )
+    response.raise_for_status()
+    payload = read_json(response)
+
+    pages = payload.get("query", {}).get("pages", [])
+    if not pages:
+        raise ValueError(f"No Wikipedia article found for subject: {subject}")
+
+    return read_page_extract(pages[0], subject)
+
+
+def read_page_extract(page: dict, title: str) -> tuple[str, str, int]:
     if page.get("missing"):
         raise ValueError(f"Wikipedia page is missing for title: {title}")
 
@@ -92,12 +145,74 @@ def fetch_page_extract(title: str, *, allow_insecure: bool) -> tuple[str, str]:
         raise ValueError(f"Wikipedia page has no extract text for title: {title}")
 
     resolved_title = page.get("title", title)
-    return resolved_title, extract
+    return resolved_title, extract, int(page.get("lastrevid") or 0)
 
 
+def fetch_latest_revision(title: str, *, allow_insecure: bool) -> int:
+    response = SESSION.get(
+        REVISION_URL.format(quote(title, safe="")),
+        timeout=20,
+        verify=not allow_insecure,
+    )
+    response.raise_for_status()
+    payload = read_json(response)
+
+    pages = payload.get("query", {}).get("pages", [])
+    if not pages or pages[0].get("missing"):
+        return 0
+    return int(pages[0].get("lastrevid") or 0)
+
+
+def get_cache_path(cache_dir: Path, subject: str) -> Path:
+    digest = hashlib.sha1(subject.casefold().encode("utf-8")).hexdigest()
+    return cache_dir / f"{digest}.json"
+
+
+def read_cache_entry(path: Path) -> dict | None:
+    try:
+        entry = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    # Anything malformed counts as a miss and is refetched.
+    if not isinstance(entry, dict):
+        return None
+    revision = entry.get("revision")
+    if not isinstance(revision, int) or isinstance(revision, bool) or revision <= 0:
+        return None
+    for key in ("title", "extract"):
+        value = entry.get(key)
+        if not isinstance(value, str) or not value:
+            return None
+    return entry
+
+
+def is_cache_fresh(path: Path, ttl_seconds: int) -> bool:
+    try:
+        return time.time() - path.stat().st_mtime < ttl_seconds
+    except OSError:
+        return False
+
+
+def write_cache_entry(path: Path, entry: dict) -> None:
+    # Write then rename so a crashed or concurrent run never leaves a torn entry.
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def lookup_extract(subject: str, *, allow_insecure: bool) -> tuple[str, str, int]:
+    try:
+        return fetch_title_and_extract(subject, allow_insecure=allow_insecure)
+    except ValueError:
+        # Full-text search can miss subjects that opensearch's title
+        # matching resolves, so fall back to the two-step lookup.
+        best_title = search_wikipedia_title(subject, allow_insecure=allow_insecure)
+        return fetch_page_extract(best_title, allow_insecure=allow_insecure)
+
+
+@lru_cache(maxsize=1024)
 def to_safe_filename(value: str) -> str:
-    normalized = value.strip().replace(" ", "_")
-    safe = re.sub(r"[\\/:*?\"<>|]", "_", normalized)
+    safe = value.strip().replace(" ", "_").translate(UNSAFE_FILENAME_CHARS)
     return safe or "wikipedia_page"
 
 
@@ -127,19 +242,86 @@ def get_env_int(name: str, default: int) -> int:
         raise SystemExit(f"Invalid integer for {name}: {value}") from exc
 
 
+class SharedContextAdapter(HTTPAdapter):
+    # Every pooled connection wraps its socket with the one context built at
+    # startup, so trust roots are loaded once rather than per connection.
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs: Any) -> None:
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+    def cert_verify(self, conn: Any, url: str, verify: Any, cert: Any) -> None:
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True:
+            # The shared context already holds the trust roots; a CA bundle
+            # path here would make urllib3 reload it on every connect.
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
+
+def configure_session(max_workers: int, *, shared_tls_context: bool) -> None:
+    # One pooled connection per worker thread so none of them block on the pool.
+    if not shared_tls_context:
+        SESSION.mount("https://", HTTPAdapter(pool_maxsize=max_workers))
+    else:
+        # Built after truststore injection so it verifies against the system store.
+        ssl_context = ssl.create_default_context()
+        SESSION.mount(
+            "https://", SharedContextAdapter(ssl_context, pool_maxsize=max_workers)
+        )
+    SESSION.mount("http://", HTTPAdapter(pool_maxsize=max_workers))
+
+
 def clear_scraped_text_files(directory: Path) -> None:
     for path in directory.glob("*.txt"):
         path.unlink()
 
 
-def scrape_subject(subject: str, *, allow_insecure: bool, output_dir: Path) -> dict:
+def scrape_subject(
+    subject: str,
+    *,
+    allow_insecure: bool,
+    output_dir: Path,
+    cache_dir: Path,
+    cache_ttl: int,
+    force_refresh: bool,
+) -> dict:
     try:
-        best_title = search_wikipedia_title(subject, allow_insecure=allow_insecure)
-        resolved_title, extract = fetch_page_extract(
-            best_title, allow_insecure=allow_insecure
-        )
+        # Cached extracts younger than the TTL are used without any request.
+        # Older ones are reused while the page revision is unchanged, so they
+        # only cost a small prop=info request.
+        cache_path = get_cache_path(cache_dir, subject)
+        cached = None if force_refresh else read_cache_entry(cache_path)
+        if cached is not None and not is_cache_fresh(cache_path, cache_ttl):
+            if cached["revision"] == fetch_latest_revision(
+                cached["title"], allow_insecure=allow_insecure
+            ):
+                cache_path.touch()
+            else:
+                cached = None
+
+        if cached is not None:
+            resolved_title, extract = cached["title"], cached["extract"]
+        else:
+            resolved_title, extract, revision = lookup_extract(
+                subject, allow_insecure=allow_insecure
+            )
+            if revision:
+                write_cache_entry(
+                    cache_path,
+                    {
+                        "subject": subject,
+                        "title": resolved_title,
+                        "revision": revision,
+                        "extract": extract,
+                    },
+                )
         output_path = output_dir / f"{to_safe_filename(resolved_title)}.txt"
-        output_path.write_text(extract, encoding="utf-8")
+        output_path.write_bytes(extract.encode("utf-8"))
     except requests.RequestException as exc:
         return {
             "subject": subject,
@@ -163,7 +345,7 @@ def scrape_subject(subject: str, *, allow_insecure: bool, output_dir: Path) -> d
 
 def main() -> None:
     load_dotenv()
-    configure_tls_from_system_store()
+    system_tls = configure_tls_from_system_store()
 
     subject_value = (os.getenv("WIKI_SUBJECT") or "").strip()
     allow_insecure = env_flag("WIKI_ALLOW_INSECURE", default=False)
@@ -177,47 +359,55 @@ def main() -> None:
     if max_workers <= 0:
         raise SystemExit("WIKI_MAX_WORKERS must be greater than 0")
     max_workers = min(max_workers, len(subjects))
+    cache_ttl = get_env_int("WIKI_CACHE_TTL", 3600)
+    if cache_ttl < 0:
+        raise SystemExit("WIKI_CACHE_TTL must be 0 or greater")
+    force_refresh = env_flag("WIKI_FORCE_REFRESH", default=False)
+    configure_session(max_workers, shared_tls_context=system_tls and not allow_insecure)
 
     output_dir = get_scraped_output_dir()
     output_dir.mkdir(parents=True, exist_ok=True)
     clear_scraped_text_files(output_dir)
+    cache_dir = get_wiki_cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
 
     print(
         f"Parallel scraping started for {len(subjects)} subjects (workers={max_workers})."
     )
 
-    results_by_subject: dict[str, dict] = {}
+    worker = partial(
+        scrape_subject,
+        allow_insecure=allow_insecure,
+        output_dir=output_dir,
+        cache_dir=cache_dir,
+        cache_ttl=cache_ttl,
+        force_refresh=force_refresh,
+    )
+    # map() yields results in subject order, which is the order they are reported.
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(
-                scrape_subject,
-                subject,
-                allow_insecure=allow_insecure,
-                output_dir=output_dir,
-            )
-            for subject in subjects
-        ]
-        for future in as_completed(futures):
-            result = future.result()
-            results_by_subject[result["subject"]] = result
+        results = list(executor.map(worker, subjects))
 
+    # Build the whole report first and emit it with one write.
+    report = io.StringIO()
     success_count = 0
     failed_subjects: list[str] = []
-    for subject in subjects:
-        result = results_by_subject[subject]
+    for subject, result in zip(subjects, results, strict=True):
+        report.write(f"Subject: {subject}\n")
         if not result["success"]:
-            print(f"Subject: {subject}")
-            print(f"Error: {result['error']}")
+            report.write(f"Error: {result['error']}\n")
             failed_subjects.append(subject)
             continue
 
-        print(f"Subject: {subject}")
-        print(f"Resolved page: {result['resolved_title']}")
-        print(f"URL: {result['url']}")
-        print(f"Saved text to: {result['output_path']}")
+        report.write(f"Resolved page: {result['resolved_title']}\n")
+        report.write(f"URL: {result['url']}\n")
+        report.write(f"Saved text to: {result['output_path']}\n")
         success_count += 1
 
-    print(f"Scrape summary: {success_count} succeeded, {len(failed_subjects)} failed.")
+    report.write(
+        f"Scrape summary: {success_count} succeeded, {len(failed_subjects)} failed.\n"
+    )
+    sys.stdout.write(report.getvalue())
+    sys.stdout.flush()
     if failed_subjects:
         failed_display = ", ".join(failed_subjects)
         raise SystemExit(f"Failed subjects: {failed_display}")